@@ -2,8 +2,10 @@ import streamlit as st
 import os, shutil, json, hashlib, logging, re
 from datetime import datetime
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-from validator import InsuranceValidator
+from validator import InsuranceValidator, OCR_CACHE_DIR, LLM_CACHE_DIR, OCR_THREADS, clear_cache_memo
 from security import initialize_security, sanitize_dict, mask_value
 
 # -----------------------------
@@ -21,6 +23,8 @@ VALID_DIR = "validated_docs"
 REVIEW_DIR = "review_needed"
 INVALID_DIR = "invalid_docs"
 TMP_DIR = "uploads_tmp"
+# OCR_THREADS (validator) = documents OCR'd at the same time; Groq calls
+# (network bound) run in their own pool and overlap with the remaining OCR
 
 for d in [VALID_DIR, REVIEW_DIR, INVALID_DIR, TMP_DIR]:
     os.makedirs(d, exist_ok=True)
@@ -62,6 +66,12 @@ def init_audit_db():
 
 init_audit_db()
 
+@st.cache_resource
+def get_validator():
+    # One validator (OCR reader + Groq client) shared by every rerun / session
+    return InsuranceValidator()
+
+
 def fuzzy_name_match(name1, name2):
     if not name1 or not name2 or name1 == "—" or name2 == "—":
         return False
@@ -324,6 +334,12 @@ with col1:
 # Sidebar
 st.sidebar.title("⚙️ Settings & Maintenance")
 
+batch_llm = st.sidebar.checkbox(
+    "⚡ Single Groq call for the 4 documents",
+    value=False,
+    help="Faster: one LLM round-trip for the whole case instead of one per document.",
+)
+
 # Check if we're in cache clear mode
 if "clear_cache_mode" not in st.session_state:
     st.session_state.clear_cache_mode = False
@@ -344,6 +360,8 @@ if st.session_state.clear_cache_mode:
         st.markdown("""
         - Audit database (audit_trail.db)
         - Fingerprint cache (fingerprints.json)
+        - OCR cache (.ocr_cache)
+        - Groq response cache (.llm_cache)
         - Temporary uploads folder
         - Validated documents folder
         - Review needed folder
@@ -368,6 +386,11 @@ if st.session_state.clear_cache_mode:
                     shutil.rmtree(d, ignore_errors=True)
                     os.makedirs(d, exist_ok=True)
 
+            shutil.rmtree(OCR_CACHE_DIR, ignore_errors=True)
+            shutil.rmtree(LLM_CACHE_DIR, ignore_errors=True)
+            st.cache_data.clear()  # in-memory Groq layer on top of LLM_CACHE_DIR
+            clear_cache_memo()  # in-memory layer of OCR_CACHE_DIR
+
             st.success("Cache cleared successfully! System reset complete.")
             st.session_state.clear_cache_mode = False
             st.balloons()
@@ -436,7 +459,7 @@ inputs = [
     ("LIFE_CONTRACT", life_file),
 ]
 
-validator = InsuranceValidator()
+validator = get_validator()
 
 case_id = hashlib.sha256(
     ("|".join([f.name for _, f in inputs]) + str(datetime.now().timestamp())).encode("utf-8")
@@ -455,8 +478,29 @@ status_text = st.empty()
 doc_results = []
 errors = []
 
+
+def ocr_document(local_path: str, file_bytes: bytes):
+    """OCR for one document (runs in an OCR worker thread)."""
+    return validator.extract_all_bytes(
+        file_bytes, os.path.splitext(local_path)[1], file_path=local_path
+    )
+
+
+def validate_document(expected_type: str, ocr: tuple):
+    """Groq for one OCR'd document (runs in a Groq worker thread)."""
+    ocr_text, structure, tech_report = ocr
+    return validator.validate_with_groq(
+        ocr_text,
+        structure,
+        tech_report,
+        forced_doc_type=expected_type,
+    )
+
+
+prepared = []
 for expected_type, uf in inputs:
-    file_bytes = uf.getbuffer().tobytes()
+    # One bytes copy of the upload, shared by hash / temp file / OCR (OCR never re-reads the disk)
+    file_bytes = uf.getvalue()
     file_hash = compute_file_hash(file_bytes)
 
     local_path = os.path.join(temp_dir, uf.name)
@@ -468,20 +512,52 @@ for expected_type, uf in inputs:
     if is_dup:
         st.warning(f"{expected_type}: File already analyzed before (previous: {prev_decision}). Re-analyzing...")
 
+    prepared.append((expected_type, uf, local_path, file_hash, file_bytes))
+
+# The 4 documents are independent: OCR them in parallel (torch releases the GIL),
+# and send each one to Groq as soon as its OCR is done, while the others are still OCR'd.
+# Worker threads get the script context so st.status / st.toast keep working.
+status_text.markdown(f"**Processing:** {', '.join(t for t, *_ in prepared)}...")
+worker_ctx = {"initializer": add_script_run_ctx, "initargs": (None, get_script_run_ctx())}
+llm_by_type = {}
+with ThreadPoolExecutor(max_workers=max(1, min(OCR_THREADS, len(prepared))), **worker_ctx) as ocr_pool, \
+        ThreadPoolExecutor(max_workers=len(prepared), **worker_ctx) as llm_pool:
+    futures = {
+        ocr_pool.submit(ocr_document, local_path, file_bytes): expected_type
+        for expected_type, _uf, local_path, _hash, file_bytes in prepared
+    }
+    for done, future in enumerate(as_completed(futures), start=1):
+        expected_type = futures[future]
+        progress_bar.progress(done / len(prepared))
+        status_text.markdown(f"**OCR done:** {expected_type} ({done}/{len(prepared)})")
+        if not batch_llm and future.exception() is None:
+            llm_by_type[expected_type] = llm_pool.submit(validate_document, expected_type, future.result())
+    by_type = {expected_type: future for future, expected_type in futures.items()}
+
+    # leaving the with-block waits for the Groq calls still running
+    if llm_by_type:
+        status_text.markdown(f"**Groq:** {', '.join(llm_by_type)}...")
+
+batch_results, batch_error = {}, None
+if batch_llm:
+    ready = {t: f.result() for t, f in by_type.items() if f.exception() is None}
+    if ready:
+        status_text.markdown(f"**Groq:** single call for {', '.join(ready)}...")
+        try:
+            batch_results = validator.validate_batch(ready)
+        except Exception as e:
+            # e.g. invalid API key: reported per document below, like the per-document path
+            batch_error = e
+
+for expected_type, uf, local_path, file_hash, _file_bytes in prepared:
     try:
-       
-        idx = [x[0] for x in inputs].index(expected_type)
-        progress = (idx) / len(inputs)
-        progress_bar.progress(progress)
-        status_text.markdown(f"**Processing:** {expected_type} ({uf.name})...")
-        
-        ocr_text, structure, tech_report = validator.extract_all(local_path, file_bytes=file_bytes)
-        result = validator.validate_with_groq(
-            ocr_text,
-            structure,
-            tech_report,
-            forced_doc_type=expected_type,
-        )
+        ocr_text, structure, tech_report = by_type[expected_type].result()
+        if batch_llm:
+            if batch_error is not None:
+                raise batch_error
+            result = batch_results[expected_type]
+        else:
+            result = llm_by_type[expected_type].result()
 
         doc_results.append({
             "expected_type": expected_type,
@@ -0,0 +1,67 @@
+"""
+ocr_server.py - Serveur OCR partagé (un seul easyocr.Reader pour tous les process Streamlit)
+
+Objectifs:
+- Charger le modèle EasyOCR UNE fois (RAM partagée, pas de cold start par worker)
+- Servir readtext / readtext_batched aux clients (validator.OCRServerClient)
+- Connexions authentifiées (authkey obligatoire, jamais en dur)
+
+Usage:
+    OCR_SERVER_AUTHKEY=... python ocr_server.py
+    OCR_SERVER_ADDRESS=127.0.0.1:8765 OCR_SERVER_AUTHKEY=... streamlit run app.py
+"""
+
+import os
+import logging
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+
+from validator import OCR_LANGS, build_easyocr_reader, parse_address
+
+logger = logging.getLogger(__name__)
+
+_METHODS = {"readtext", "readtext_batched"}
+
+
+def _serve(conn, reader, lock: threading.Lock) -> None:
+    # One thread per client connection; the model itself runs one request at a time
+    with conn:
+        while True:
+            try:
+                method, args, kwargs = conn.recv()
+            except (EOFError, OSError):
+                return
+
+            if method not in _METHODS:
+                conn.send(("error", f"méthode inconnue: {method}"))
+                continue
+            try:
+                with lock:
+                    result = getattr(reader, method)(*args, **kwargs)
+                conn.send(("ok", result))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    address = parse_address(os.getenv("OCR_SERVER_ADDRESS", "127.0.0.1:8765"))
+    authkey = os.environ["OCR_SERVER_AUTHKEY"].encode("utf-8")
+
+    reader = build_easyocr_reader()
+    lock = threading.Lock()
+
+    with Listener(address, authkey=authkey) as listener:
+        logger.info("OCR server ready on %s:%s (%s)", *address, "+".join(OCR_LANGS))
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                logger.warning("OCR server: connexion refusée (authkey invalide)")
+                continue
+            threading.Thread(target=_serve, args=(conn, reader, lock), daemon=True).start()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,31 @@
+import io
 import os
 import re
-import json
+import orjson
+import hashlib
+import multiprocessing
+import threading
+import copy
+import queue
+import time
+import bisect
+import sys
+from functools import lru_cache
 import fitz  # PyMuPDF
 import easyocr
+import numpy as np
+import cv2
+import torch
+from PIL import Image
 import groq
 import streamlit as st
 from groq import Groq
 from dotenv import load_dotenv
-from datetime import datetime, date, timedelta
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client
+from image_preprocess import resize_for_ocr
 from utils import (
     validate_iban,
     validate_date_format,
@@ -22,54 +40,110 @@ load_dotenv()
 # ----------------------------
 # Helpers
 # ----------------------------
+# Patterns compiled once at import (no per-call re cache lookup / parsing)
+_RE_SPACES = re.compile(r"\s+")
+_RE_DIGITS = re.compile(r"\d+")
+_RE_NAME_BAD = re.compile(r"[^A-Za-zÀ-ÖØ-öø-ÿ\s']")
+_RE_NON_ALNUM = re.compile(r"[^A-Z0-9]")
+_RE_CNE_RAW = re.compile(r"\b[A-Z]{2}\s*[-]?\s*\d{6}\b")
+_RE_DATE_SEP = re.compile(r"[.\-]")
+_RE_DATE_SHAPE = re.compile(r"(\d{1,4})/(\d{1,2})/(\d{1,4})")
+# one scan for the 3 units: group 2 = years, 3 = months, 4 = days
+_RE_DURATION = re.compile(
+    r"(\d+)\s*(?:(ans?|années?|annees?|year|years)|(mois|month|months)|(jours?|day|days))"
+)
+_DURATION_DAYS = {2: 365, 3: 30, 4: 1}
+# PDF creator/producer of an editing tool => suspicious metadata
+FRAUD_TOOLS = ("canva", "photoshop", "illustrator", "gimp", "inkscape", "adobe acrobat pro")
+_RE_FRAUD_TOOLS = re.compile("|".join(map(re.escape, FRAUD_TOOLS)))
+
+
+class _KeepOnly(dict):
+    """
+    str.translate table keeping only the chars matching `keep` (others deleted).
+    Filled lazily per code point, then pure C lookups: ~2x faster than re.sub.
+    """
+
+    def __init__(self, keep):
+        super().__init__()
+        self._keep = keep
+
+    def __missing__(self, cp: int):
+        v = cp if self._keep(chr(cp)) else None
+        self[cp] = v
+        return v
+
+
+# same sets as r"\D" (Unicode decimal digits) and r"[^A-Z0-9]"
+_KEEP_DIGITS = _KeepOnly(str.isdecimal)
+_KEEP_UPPER_ALNUM = _KeepOnly(lambda c: "A" <= c <= "Z" or "0" <= c <= "9")
+
+
 def _norm_spaces(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "").strip())
+    return _RE_SPACES.sub(" ", (s or "").strip())
 
 
 def _clean_name(s: str) -> str:
     s = (s or "").strip()
     # 1. Remove any digits found in the name
-    s = re.sub(r"\d+", " ", s)
+    s = _RE_DIGITS.sub(" ", s)
 
     # 2. REMOVE THE HYPHEN HERE:
-    # Before: s = re.sub(r"[^A-Za-zÀ-ÖØ-öø-ÿ\s\-']", " ", s)
-    # After:
-    s = re.sub(r"[^A-Za-zÀ-ÖØ-öø-ÿ\s']", " ", s)
+    # Before: [^A-Za-zÀ-ÖØ-öø-ÿ\s\-']
+    # After: _RE_NAME_BAD
+    s = _RE_NAME_BAD.sub(" ", s)
 
     # 3. Collapse the resulting double spaces
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _RE_SPACES.sub(" ", s).strip()
     return s
 
 
 
+# Pure functions of short strings, called several times per document on the
+# same candidates (Groq field, context fallback, final check)
+@lru_cache(maxsize=2048)
 def _normalize_cne(s: str) -> str:
     s = (s or "").upper()
-    s = re.sub(r"[^A-Z0-9]", "", s)
+    s = _RE_NON_ALNUM.sub("", s)
     return s
 
 
+@lru_cache(maxsize=2048)
 def _is_cne_strict(s: str) -> bool:
-    return bool(re.fullmatch(r"[A-Z]{1,2}\d{6}", _normalize_cne(s)))
+    # [A-Z]{1,2}\d{6} without the regex engine: after _normalize_cne only
+    # A-Z / 0-9 remain, so isalpha / isdigit are exactly those classes
+    s = _normalize_cne(s)
+    k = len(s) - 6
+    return 1 <= k <= 2 and s[:k].isalpha() and s[k:].isdigit()
 
 
+@lru_cache(maxsize=4096)  # same dates recur across fields / documents; date is immutable
 def _parse_date_any(s: str) -> date | None:
     s = _norm_spaces(s)
     if not s:
         return None
 
-    s2 = re.sub(r"[.\-]", "/", s)
-    s2 = re.sub(r"\s+", "/", s2)
+    s2 = _RE_DATE_SEP.sub("/", s)
+    s2 = s2.replace(" ", "/")  # _norm_spaces left single spaces only
 
-    for fmt in ("%d/%m/%Y", "%Y/%m/%d"):
-        try:
-            return datetime.strptime(s2, fmt).date()
-        except Exception:
-            pass
+    m = _RE_DATE_SHAPE.fullmatch(s2)
+    if not m:
+        return None
 
-    try:
-        return datetime.strptime(s, "%Y-%m-%d").date()
-    except Exception:
+    # Hand-rolled "%d/%m/%Y" then "%Y/%m/%d" (same acceptance as strptime:
+    # %Y = exactly 4 digits, %d/%m = 1-2 digits, no zero day/month).
+    # "%Y-%m-%d" is covered by "%Y/%m/%d" once separators are unified.
+    a, b, c = m.groups()
+    mo = int(b)
+    if not 1 <= mo <= 12:
         return None
+    for y, d in ((c, a), (a, c)):
+        if len(y) == 4 and len(d) <= 2:
+            try:
+                return date(int(y), mo, int(d))
+            except ValueError:
+                pass
+    return None
 
 
 def _parse_duration_to_timedelta(s: str) -> timedelta | None:
@@ -77,26 +151,23 @@ def _parse_duration_to_timedelta(s: str) -> timedelta | None:
     if not s:
         return None
 
-    years = sum(int(x) for x in re.findall(r"(\d+)\s*(?:ans?|années?|annees?|year|years)", s))
-    months = sum(int(x) for x in re.findall(r"(\d+)\s*(?:mois|month|months)", s))
-    days = sum(int(x) for x in re.findall(r"(\d+)\s*(?:jours?|day|days)", s))
+    total = 0
+    for m in _RE_DURATION.finditer(s):
+        total += int(m.group(1)) * _DURATION_DAYS[m.lastindex]
 
-    if years == 0 and months == 0 and days == 0:
+    if total == 0:
         return None
-    return timedelta(days=years * 365 + months * 30 + days)
+    return timedelta(days=total)
 
 
-def _extract_cne_by_context(text: str, keywords: list[str]) -> str:
+def _extract_cne_by_context(text_upper: str, keywords: tuple[str, ...]) -> str:
     """
     Find strict CNE near keywords. If nothing, return first strict CNE.
+    text_upper = OCR text ALREADY uppercased (done once per document by the caller).
     """
-    t = (text or "").upper()
-    raw_matches = list(re.finditer(r"\b[A-Z]{2}\s*[-]?\s*\d{6}\b", t))
-    if not raw_matches:
-        return ""
-
+    t = text_upper or ""
     strict = []
-    for m in raw_matches:
+    for m in _RE_CNE_RAW.finditer(t):
         c = _normalize_cne(m.group(0))
         if _is_cne_strict(c):
             strict.append((c, m.start()))
@@ -107,147 +178,387 @@ def _extract_cne_by_context(text: str, keywords: list[str]) -> str:
     if not keywords:
         return strict[0][0]
 
+    scanner = _keyword_scanner(keywords)
+    if scanner is None:  # empty keyword: matches any window
+        return strict[0][0]
+
+    # ONE pass over the text for all keywords (instead of CNEs x keywords
+    # substring searches). Hits sorted by end + running max of their starts:
+    # a CNE at pos has a keyword fully inside its 120-char left window iff
+    # the latest-starting hit among those ending <= pos starts >= pos - 120.
+    hits = sorted((m.start() + len(m.group(1)), m.start()) for m in scanner.finditer(t))
+    ends = [e for e, _s in hits]
+    max_start = []
+    best = -1
+    for _e, start in hits:
+        best = max(best, start)
+        max_start.append(best)
+
     for c, pos in strict:
-        left = t[max(0, pos - 120):pos]
-        if any(k.upper() in left for k in keywords):
+        k = bisect.bisect_right(ends, pos)
+        if k and max_start[k - 1] >= pos - 120:
             return c
 
     return strict[0][0]
 
 
+@lru_cache(maxsize=32)
+def _keyword_scanner(keywords: tuple[str, ...]) -> re.Pattern | None:
+    """
+    Zero-width lookahead alternation: reports EVERY start position of any keyword
+    (overlaps included), shortest keyword first so each start gets its earliest end.
+    """
+    kws = sorted({k.upper() for k in keywords}, key=len)
+    if not kws or not kws[0]:
+        return None
+    return re.compile("(?=(" + "|".join(map(re.escape, kws)) + "))")
+
+
 # ----------------------------
-# Cached EasyOCR Reader
+# OCR disk cache
 # ----------------------------
-@st.cache_resource
-def get_ocr_reader():
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", ".ocr_cache")
+OCR_LANGS = ["fr", "en"]
+# "easyocr" (default) or "tesserocr" (needs tesseract + fra/eng traineddata installed)
+OCR_BACKEND = os.getenv("OCR_BACKEND", "easyocr").lower()
+# 108 DPI == the former 1.5 zoom on 72 DPI pages; rendered as 1-channel gray
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "108"))
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))
+# A page whose embedded text layer is longer than this is NOT OCR'd
+# (200: a real text layer, not just a title/stamp over a scan)
+NATIVE_TEXT_MIN_CHARS = int(os.getenv("NATIVE_TEXT_MIN_CHARS", "200"))
+# Long edge cap (px) of any image sent to OCR (uploads and rendered pages)
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "1600"))
+# Documents OCR'd at the same time by app.py (CPU/GPU bound: more threads only fight for the cores)
+OCR_THREADS = int(os.getenv("OCR_THREADS", "2"))
+# > 1 => scanned pages are OCR'd in parallel by a pool of worker processes
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0"))
+# OCR_GPU=1 => models stay on CUDA (fp32: CRAFT's score maps go through cv2, no float16)
+OCR_GPU = os.getenv("OCR_GPU", "0") == "1" and torch.cuda.is_available()
+OCR_READER_ID = f"{OCR_BACKEND}:{'+'.join(OCR_LANGS)}"
+# Recognizer DataLoader workers (0 = in the calling thread; >0 spawns processes per call)
+OCR_LOADER_WORKERS = int(os.getenv("OCR_LOADER_WORKERS", "0"))
+# Same decoding options on every readtext call: text only, greedy CTC decoding
+# (pinned explicitly: beam search is several times slower for ~no gain on printed forms)
+_READTEXT_KW = {"detail": 0, "decoder": "greedy", "workers": OCR_LOADER_WORKERS}
+# Console dump of the full OCR text of every document (DEBUG_OCR=1)
+DEBUG_OCR = os.getenv("DEBUG_OCR", "0") == "1"
+# Shared OCR server (ocr_server.py): "host:port"; empty = reader loaded in this process
+OCR_SERVER_ADDRESS = os.getenv("OCR_SERVER_ADDRESS", "")
+# One dummy inference at reader creation (cuDNN autotune / lazy init out of the first document)
+OCR_WARMUP = os.getenv("OCR_WARMUP", "1" if OCR_GPU else "0") == "1"
+
+
+# In-process layer over the OCR disk cache: Streamlit reruns / re-uploads in the same
+# process skip the file read + JSON decode. Bounded, oldest entry evicted first.
+# (LLM_CACHE_DIR already has its own in-memory layer: st.cache_data in _groq_json_cached)
+_CACHE_MEMO: dict[tuple[str, str], object] = {}
+_CACHE_MEMO_MAX = 256
+_CACHE_MEMO_LOCK = threading.Lock()
+
+
+def _memo_put(cache_dir: str, key: str, value) -> None:
+    if cache_dir != OCR_CACHE_DIR:
+        return
+    with _CACHE_MEMO_LOCK:
+        _CACHE_MEMO[(cache_dir, key)] = value
+        if len(_CACHE_MEMO) > _CACHE_MEMO_MAX:
+            del _CACHE_MEMO[next(iter(_CACHE_MEMO))]
+
+
+def clear_cache_memo() -> None:
+    with _CACHE_MEMO_LOCK:
+        _CACHE_MEMO.clear()
+
+
+def _cache_get(cache_dir: str, key: str):
+    # callers may mutate what they get (e.g. tech_report["file_path"]): hand out copies
+    memo = _CACHE_MEMO.get((cache_dir, key))
+    if memo is not None:
+        return copy.deepcopy(memo)
+
+    path = os.path.join(cache_dir, f"{key}.json")
+    try:
+        with open(path, "rb") as f:
+            value = orjson.loads(f.read())
+    except (OSError, ValueError):  # orjson.JSONDecodeError is a ValueError
+        return None
+    _memo_put(cache_dir, key, value)
+    return copy.deepcopy(value)
+
+
+def _cache_set(cache_dir: str, key: str, value) -> None:
     """
-    Cache the EasyOCR reader to avoid reloading on every run.
-    French + English only (NO Arabic to avoid errors).
+    Atomic write (tmp file + os.replace) so a crash never leaves half a JSON.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(value))
+    os.replace(tmp_path, path)
+    _memo_put(cache_dir, key, copy.deepcopy(value))
+
+
+# PyMuPDF is not thread-safe: documents are parsed/rendered one at a time,
+# only the OCR itself runs concurrently.
+_FITZ_LOCK = threading.Lock()
+
+
+def _content_key(data, config_id: str) -> str:
+    # data: bytes or any C-contiguous buffer (numpy array) -> no concat copy
+    h = hashlib.blake2b(data)
+    h.update(config_id.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _pixmap_to_array(pix) -> np.ndarray:
+    """
+    Raw pixmap samples -> numpy (H, W) gray or (H, W, C). EasyOCR takes ndarrays
+    directly, so no PNG encode (PyMuPDF) + PNG decode (EasyOCR) per page.
+    """
+    if pix.n == 1:
+        return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pix.n == 4:
+        arr = np.ascontiguousarray(arr[..., :3])
+    return arr
+
+
+def _decode_gray(file_bytes: bytes) -> np.ndarray:
+    """Uploaded jpg/png/webp bytes -> (H, W) uint8, decoded once, long edge capped."""
+    img = cv2.imdecode(np.frombuffer(file_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError("Image illisible (format non supporté ou fichier corrompu).")
+    return resize_for_ocr(img, OCR_MAX_SIDE)
+
+
+def _pad_stack(images: list[np.ndarray]) -> np.ndarray:
+    """
+    (N, H, W[, C]) uint8 array, H/W = max page size, pages copied top-left,
+    the rest white (paper colour, so the detector sees no fake edges).
     """
-    return easyocr.Reader(["fr", "en"], gpu=False)
+    h = max(img.shape[0] for img in images)
+    w = max(img.shape[1] for img in images)
+    stack = np.full((len(images), h, w) + images[0].shape[2:], 255, dtype=np.uint8)
+    for out, img in zip(stack, images):
+        out[: img.shape[0], : img.shape[1]] = img
+    return stack
 
 
 # ----------------------------
-# Main class
+# Tesseract backend (OCR_BACKEND=tesserocr)
 # ----------------------------
-class InsuranceValidator:
+class TesseractReader:
     """
-    POLICY:
-    - NEVER auto-reject
-    - ONLY: ACCEPT or REVIEW
+    Same readtext / readtext_batched surface as easyocr.Reader (detail=0),
+    backed by the resident tesseract C++ API: no model reload, image passed
+    from memory, GIL released during recognition.
+    PyTessBaseAPI is not thread-safe => a fixed set of APIs (one per OCR
+    thread), created once and checked out per call: Streamlit reruns and new
+    thread pools never reload the traineddata.
     """
 
-    def __init__(self):
-        # Use cached reader (French + English only)
-        self.reader = get_ocr_reader()
+    _TESS_LANGS = {"fr": "fra", "en": "eng", "ar": "ara"}
 
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
-            raise ValueError("GROQ_API_KEY non trouvée ! Vérifiez votre fichier .env.")
-        self.client = Groq(api_key=api_key)
-        self.groq_timeout = 30
+    def __init__(self, langs: list[str], size: int = OCR_THREADS):
+        import tesserocr  # optional dependency, only for this backend
 
-    def analyze_technical_integrity(self, doc, file_path: str) -> dict:
-        metadata = doc.metadata or {}
-        fraud_tools = ["canva", "photoshop", "illustrator", "gimp", "inkscape", "adobe acrobat pro"]
-        creator = (metadata.get("creator") or "").lower()
-        producer = (metadata.get("producer") or "").lower()
-        is_suspicious_tool = any(tool in creator or tool in producer for tool in fraud_tools)
+        lang = "+".join(self._TESS_LANGS[l] for l in langs)
+        self._apis = queue.Queue()
+        for _ in range(max(1, size)):
+            self._apis.put(tesserocr.PyTessBaseAPI(lang=lang, psm=tesserocr.PSM.AUTO))
 
-        fonts = []
-        for page in doc:
-            fonts.extend([f[3] for f in page.get_fonts()])
-        font_count = len(set(fonts))
+    def readtext(self, image, detail: int = 0, **_kwargs) -> list[str]:
+        if isinstance(image, (bytes, bytearray)):
+            img = Image.open(io.BytesIO(image))
+        else:
+            img = Image.fromarray(np.squeeze(image))
+        api = self._apis.get()  # blocks while every API is busy
+        try:
+            api.SetImage(img)
+            text = api.GetUTF8Text()
+        finally:
+            self._apis.put(api)
+        return [line.strip() for line in text.splitlines() if line.strip()]
 
-        potential_tampering = bool(is_suspicious_tool or font_count > 8)
+    def readtext_batched(self, images, detail: int = 0, **_kwargs) -> list[list[str]]:
+        # no resize needed: tesseract works on each page at its own size
+        return [self.readtext(img) for img in images]
 
-        return {
-            "suspicious_metadata": bool(is_suspicious_tool),
-            "editor_detected": creator if creator else producer,
-            "font_count": font_count,
-            "potential_tampering": potential_tampering,
-            "file_path": file_path,
-        }
 
-    def extract_all(self, file_path: str, file_bytes: bytes | None = None, fileName=None):
-        """
-        OCR:
-        - PDF via PyMuPDF pages -> pixmap -> bytes png (LOWER ZOOM = 0.8 for speed)
-        - IMAGE via bytes (jpg/png/webp) passed from app.py
-        """
-        # Add this line at the start
-        # This creates a visual progress box in the Streamlit UI
-        file_name = os.path.basename(file_path)
-        with st.status(f"Analyse de {file_name}...", expanded=False) as status:
-            st.write("🔍 [Etape 1/2] Extraction du texte (OCR)...")
-            print(f"🔍 OCR: {file_name}")
-        ext = os.path.splitext(file_path)[1].lower()
+# ----------------------------
+# Shared OCR server client (OCR_SERVER_ADDRESS)
+# ----------------------------
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
 
 
-        # IMAGE mode
-        if ext in [".png", ".jpg", ".jpeg", ".webp"] and file_bytes is not None:
-            structure = {"has_images": True, "page_count": 1, "has_tables": False}
-            tech_report = {
-                "suspicious_metadata": False,
-                "editor_detected": "image_upload",
-                "font_count": 0,
-                "potential_tampering": False,
-                "file_path": file_path,
-            }
+class OCRServerClient:
+    """
+    Same readtext / readtext_batched surface as easyocr.Reader, forwarded to
+    ocr_server.py: ONE model in RAM for all Streamlit processes, no per-process
+    cold start. numpy arrays are pickled over the connection.
+    A Connection is not thread-safe => one connection per thread.
+    """
 
-            # EasyOCR accepts bytes for readtext
-            text_results = self.reader.readtext(file_bytes, detail=0)
-            # validator.py
+    def __init__(self, address: str, authkey: bytes):
+        self._address = parse_address(address)
+        self._authkey = authkey
+        self._local = threading.local()
 
-            # ... after the existing text_results.extend(...) ...
-            text_results.extend(self.reader.readtext(file_bytes, detail=0))
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self._address, authkey=self._authkey)
+            self._local.conn = conn
+        return conn
 
-            # --- ADD THIS FOR CONSOLE DEBUGGING ---
-            print(f"\n--- DEBUG: RAW OCR FOR {file_path} ---")
-            print(" ".join(text_results))
-            print("-" * 40 + "\n")
-            # --------------------------------------
-            return " ".join(text_results), structure, tech_report
+    def _call(self, method: str, *args, **kwargs):
+        conn = self._conn()
+        try:
+            conn.send((method, args, kwargs))
+            status, payload = conn.recv()
+        except (OSError, EOFError):
+            self._local.conn = None  # server restarted: reconnect on next call
+            raise
+        if status != "ok":
+            raise RuntimeError(f"OCR server: {payload}")
+        return payload
 
-        # PDF mode
-        text_results = []
-        structure = {"has_images": False, "page_count": 0, "has_tables": False}
-
-        doc = fitz.open(file_path)
-        structure["page_count"] = len(doc)
-        tech_report = self.analyze_technical_integrity(doc, file_path)
-
-        for page in doc:
-            if len(page.get_images()) > 0:
-                structure["has_images"] = True
-            if len(page.get_drawings()) > 10:
-                structure["has_tables"] = True
-
-            # REDUCED DPI (0.8 instead of 1.2) => MUCH FASTER, still readable
-            pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
-            img_bytes = pix.tobytes("png")
-            text_results.extend(self.reader.readtext(img_bytes, detail=0))
-        raw_text = " ".join(text_results)
-        print(f"DEBUG FULL OCR: {raw_text}")
-        st.write("📝 Texte extrait avec succès.")
-        status.update(label=f"OCR terminé pour {file_name}", state="complete")
-        return " ".join(text_results), structure, tech_report
+    def readtext(self, image, detail: int = 0, **kwargs) -> list[str]:
+        return self._call("readtext", image, detail=detail, **kwargs)
 
-    def validate_with_groq(self, text: str, structure: dict, tech_report: dict, forced_doc_type: str):
-        # Show a small notification at the bottom of the screen
-        st.toast(f"🧠 Intelligence Artificielle : Analyse du document {forced_doc_type}...")
+    def readtext_batched(self, images, detail: int = 0, **kwargs) -> list[list[str]]:
+        return self._call("readtext_batched", list(images), detail=detail, **kwargs)
 
-        forced_doc_type = (forced_doc_type or "").strip().upper()
-        if forced_doc_type not in {"ID", "BANK", "DEATH", "LIFE_CONTRACT"}:
-            forced_doc_type = "UNKNOWN"
 
-        prompt = f"""
+# ----------------------------
+# Cached OCR Reader
+# ----------------------------
+@st.cache_resource
+def get_ocr_reader():
+    """
+    Cache the OCR reader to avoid reloading on every run.
+    French + English only (NO Arabic to avoid errors).
+    - CPU: quantize=True => int8 dynamic quantization of the recognizer
+    - GPU: cudnn_benchmark picks the fastest conv algorithms
+    - OCR_SERVER_ADDRESS set: thin client of the shared ocr_server.py
+    """
+    if OCR_SERVER_ADDRESS:
+        return OCRServerClient(OCR_SERVER_ADDRESS, os.environ["OCR_SERVER_AUTHKEY"].encode("utf-8"))
+    if OCR_BACKEND == "tesserocr":
+        return TesseractReader(OCR_LANGS)
+    return build_easyocr_reader()
+
+
+def build_easyocr_reader():
+    """
+    The local EasyOCR reader (fr + en, quantized, warmed up if OCR_WARMUP).
+    Public: ocr_server.py builds its shared reader with the same setup.
+    """
+    reader = easyocr.Reader(OCR_LANGS, gpu=OCR_GPU, quantize=True, cudnn_benchmark=OCR_GPU)
+    if OCR_WARMUP:
+        _warmup_reader(reader)
+    return reader
+
+
+def _warmup_reader(reader) -> None:
+    # Blank A4 page at the render DPI: same input shape as real scanned pages
+    h, w = round(11.69 * PDF_OCR_DPI), round(8.27 * PDF_OCR_DPI)
+    page = np.full((h, w), 255, dtype=np.uint8)
+    reader.readtext_batched([page], batch_size=OCR_BATCH_SIZE, **_READTEXT_KW)
+
+
+# ----------------------------
+# OCR process pool (optional, OCR_WORKERS > 1)
+# ----------------------------
+_worker_reader = None
+
+
+def _init_ocr_worker(langs: list[str]):
+    """
+    One EasyOCR reader per worker process, 1 thread each:
+    N workers x default OpenMP threads would over-subscribe the CPU.
+    (OMP_* env vars come from get_ocr_pool: torch is already imported here.)
+    """
+    global _worker_reader
+    torch.set_num_threads(1)
+    _worker_reader = easyocr.Reader(langs, gpu=False, verbose=False)
+
+
+# Workers only attach: the parent owns (and unlinks) the block; track=False needs 3.13+
+_SHM_ATTACH_KW = {"track": False} if sys.version_info >= (3, 13) else {}
+
+
+def _ocr_page(args) -> list[str]:
+    # Top-level function: must be picklable for Pool.map.
+    # Only (block name, offset, shape) crosses the pipe, the pixels stay in shared memory
+    name, offset, shape = args
+    shm = shared_memory.SharedMemory(name=name, **_SHM_ATTACH_KW)
+    img = None
+    try:
+        img = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+        return _worker_reader.readtext(img, **_READTEXT_KW)
+    finally:
+        # drop the view first: no array left pointing into memory unmapped by close()
+        del img
+        shm.close()
+
+
+@st.cache_resource
+def get_ocr_pool():
+    """
+    Long-lived pool (models are loaded once per worker, not per document).
+    spawn: forking a process that already holds torch state is unsafe.
+    """
+    workers = max(1, min(OCR_WORKERS, (os.cpu_count() or 2) - 1))
+    # OMP limits only for the spawned workers (read by OpenMP when they import torch):
+    # set while the pool starts, then restored so this process' threads keep all cores
+    limits = {"OMP_THREAD_LIMIT": "1", "OMP_NUM_THREADS": "1"}
+    saved = {k: os.environ.get(k) for k in limits}
+    os.environ.update(limits)
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        return ctx.Pool(workers, initializer=_init_ocr_worker, initargs=(OCR_LANGS,))
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+# ----------------------------
+# Groq prompt (static part, shared by every document)
+# ----------------------------
+# Change "llama-3.3-70b-versatile" to "llama3-8b-8192"
+GROQ_MODEL = "llama-3.1-8b-instant"
+# Model per document type: the 8B model is enough for structured extraction.
+# GROQ_MODEL_<TYPE> (e.g. GROQ_MODEL_LIFE_CONTRACT=llama-3.3-70b-versatile)
+# moves only that type to a bigger model.
+_MODEL_BY_DOC = {
+    t: os.getenv(f"GROQ_MODEL_{t}", GROQ_MODEL)
+    for t in ("ID", "BANK", "DEATH", "LIFE_CONTRACT")
+}
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm_cache")
+# (timeout s, pause s before the attempt): 6+8+12 + 3 s of backoff < former single 30 s timeout
+GROQ_ATTEMPTS = ((6, 0), (8, 1.0), (12, 2.0))
+
+
+def _groq_transient(e: Exception) -> bool:
+    # Same statuses the SDK's own retry covers (disabled, see InsuranceValidator.__init__)
+    if not isinstance(e, groq.APIStatusError):
+        return True
+    return e.status_code in (408, 409, 429) or e.status_code >= 500
+
+
+_GROQ_INSTRUCTIONS = """
 RÔLE : Auditeur Expert en Assurance (MAROC).
 MISSION : Extraire les données du texte OCR pour un dossier de succession.
 RÈGLE D'OR : Analyse UNIQUEMENT le texte fourni. Ne réutilise JAMAIS des noms ou CNE vus dans d'autres documents.
 
-TYPE DE DOCUMENT ATTENDU : {forced_doc_type}
-
 ---
 DIRECTIVES PAR TYPE :
 
@@ -275,29 +586,20 @@ DIRECTIVES CRITIQUES:
 3. Si l'OCR dit 'CD936873', n'utilise pas 'CD112323'.
 ---
 
-TEXTE OCR:
-{text[:6000]}
-
-STRUCTURE:
-{json.dumps(structure, ensure_ascii=False)}
-
-TECH REPORT:
-{json.dumps(tech_report, ensure_ascii=False)}
-
 TU DOIS GÉNÉRER UN JSON CONFORME AU FORMAT CI-DESSOUS. Ne produit AUCUN texte explicatif.
 
 Champs:
 - "decision": "ACCEPT" OU "REVIEW" uniquement. Jamais REJECT.
 - "score": 0-100
 - "country": "MAROC"
-- "doc_type": "{forced_doc_type}"
+- "doc_type": le TYPE DE DOCUMENT ATTENDU
 - "fraud_suspected": true/false
 - "fraud_signals": ["signal1", "signal2"]
 - "extracted_data":
-  * Si {forced_doc_type} = ID: cni_full_name, cni_cne, cni_birth_date, cni_expiry_date
-  * Si {forced_doc_type} = BANK: bank_account_holder, bank_code_banque, bank_code_ville, bank_numero_compte, bank_cle_rib, bank_iban
-  * Si {forced_doc_type} = DEATH: deceased_full_name, deceased_cne, deceased_birth_date, death_date
-  * Si {forced_doc_type} = LIFE_CONTRACT: insured_full_name, insured_cne, insured_birth_date, beneficiary_full_name, beneficiary_cne, beneficiary_birth_date, contract_effective_date, contract_duration, contract_end_date
+  * Si TYPE = ID: cni_full_name, cni_cne, cni_birth_date, cni_expiry_date
+  * Si TYPE = BANK: bank_account_holder, bank_code_banque, bank_code_ville, bank_numero_compte, bank_cle_rib, bank_iban
+  * Si TYPE = DEATH: deceased_full_name, deceased_cne, deceased_birth_date, death_date
+  * Si TYPE = LIFE_CONTRACT: insured_full_name, insured_cne, insured_birth_date, beneficiary_full_name, beneficiary_cne, beneficiary_birth_date, contract_effective_date, contract_duration, contract_end_date
 - "format_validation":
   * dates_format_valid: true/false
   * rib_format_valid: true/false
@@ -320,85 +622,85 @@ CONTRAINTES:
 EXEMPLES:
 
 TYPE: ID
-{{
+{
   "decision": "REVIEW",
   "score": 89,
   "country": "MAROC",
   "doc_type": "ID",
   "fraud_suspected": false,
   "fraud_signals": [],
-  "extracted_data": {{
+  "extracted_data": {
     "cni_full_name": "BENALI MOHAMED",
     "cni_cne": "AB123456",
     "cni_birth_date": "15/03/1985",
     "cni_expiry_date": "20/08/2020"
-  }},
-  "format_validation": {{
+  },
+  "format_validation": {
     "dates_format_valid": true,
     "rib_format_valid": true,
     "iban_format_valid": true,
     "cne_format_valid": true
-  }},
+  },
   "reason": "CNI bien extraite, CNE valide, date expiration incorrecte."
-}}
+}
 
 TYPE: BANK
-{{
+{
   "decision": "REVIEW",
   "score": 70,
   "country": "MAROC",
   "doc_type": "BANK",
   "fraud_suspected": false,
   "fraud_signals": [],
-  "extracted_data": {{
+  "extracted_data": {
     "bank_account_holder": "BENALI MOHAMED",
     "bank_code_banque": "011",
     "bank_code_ville": "640",
     "bank_numero_compte": "1234567890123456",
     "bank_cle_rib": "78",
     "bank_iban": "MA64230270457496521100710060"
-  }},
-  "format_validation": {{
+  },
+  "format_validation": {
     "dates_format_valid": true,
     "rib_format_valid": true,
     "iban_format_valid": true,
     "cne_format_valid": true
-  }},
+  },
   "reason": "RIB présent, IBAN correct, clé valide."
-}}
+}
 
 TYPE: DEATH
-{{
+{
   "decision": "REVIEW",
   "score": 97,
   "country": "MAROC",
   "doc_type": "DEATH",
   "fraud_suspected": false,
   "fraud_signals": [],
-  "extracted_data": {{
+  "extracted_data": {
     "deceased_full_name": "BENALI MOHAMED",
     "deceased_cne": "AB123456",
     "deceased_birth_date": "15/03/1985",
     "death_date": "10/12/2023"
-  }},
-  "format_validation": {{
+  },
+  "format_validation": {
     "dates_format_valid": true,
     "rib_format_valid": true,
     "iban_format_valid": true,
     "cne_format_valid": true
-  }},
+  },
   
-}}
+}
 
 TYPE: LIFE_CONTRACT
-{{
+{
   "decision": "ACCEPT",
   "score": 90,
   "country": "MAROC",
   "doc_type": "LIFE_CONTRACT",
   "fraud_suspected": false,
   "fraud_signals": [],
-  "extracted_data": {{
+  "extracted_data": {
     "insured_full_name": "BENALI MOHAMED",
     "insured_cne": "AB123456",
     "insured_birth_date": "15/03/1985",
@@ -408,27 +710,448 @@ TYPE: LIFE_CONTRACT
     "contract_effective_date": "01/01/2010",
     "contract_duration": "15 ans",
     "contract_end_date": ""
-  }},
-  "format_validation": {{
+  },
+  "format_validation": {
     "dates_format_valid": true,
     "rib_format_valid": true,
     "iban_format_valid": true,
     "cne_format_valid": true
-  }},
+  },
   "reason": ""
-}}
+}
+""".strip()
+
+
+# Local pre-filter: a document of the expected type always carries at least one of
+# these words (accents / OCR noise tolerated). No match = no Groq call.
+_DOC_TYPE_KEYWORDS = {
+    "ID": re.compile(r"royaume|maroc|morocco|carte|identit|cnie?\b|nationale?|naissance|المملكة|البطاقة", re.I),
+    "BANK": re.compile(r"banque|bank|\brib\b|iban|compte|agence|swift|titulaire|relev", re.I),
+    "DEATH": re.compile(r"d[ée]c[èeé]s|d[ée]c[ée]d|death|acte|mort|وفاة", re.I),
+    "LIFE_CONTRACT": re.compile(r"assur|polic|contrat|attestation|insur|b[ée]n[ée]ficiaire|souscri|capital", re.I),
+}
+
+
+_GROQ_BATCH_FORMAT = """
+DOSSIER MULTI-DOCUMENTS : chaque document ci-dessous est INDÉPENDANT.
+Applique les règles ci-dessus à CHAQUE document séparément : un nom ou un CNE lu dans un document
+ne doit JAMAIS être recopié dans le résultat d'un autre document.
+RÉPONSE : UN SEUL objet JSON dont les clés sont les TYPES DE DOCUMENT ATTENDUS ({types})
+et chaque valeur est le JSON complet de ce document (même format que les EXEMPLES).
+""".strip()
+
+
+# Standalone punctuation/OCR noise tokens ("|", "—", "»", "***"...); keeps the
+# separators that belong to dates / codes / amounts / labels
+_RE_NOISE_TOKEN = re.compile(r"(?<!\S)[^\w\s/:.,'%€\-]+(?!\S)")
+
+
+# Runs of 4+ identical punctuation chars (dot leaders, "-----", "____") -> 2;
+# digits and letters are never touched (RIB "0000...", names)
+_RE_PUNCT_RUN = re.compile(r"([^\w\s]|_)\1{3,}")
+# CNE / IBAN / RIB-looking identifiers: what the first 4000 chars must contain
+_RE_PROMPT_KEY_ID = re.compile(r"\b[A-Z]{1,2}\s*-?\s*\d{6}\b|\bMA\d{2}|\d[\d ]{15,}\d", re.I)
+# identifiers expected per doc type (insured + beneficiary on a contract)
+_PROMPT_KEY_IDS_NEEDED = {"LIFE_CONTRACT": 2}
+PROMPT_TEXT_CHARS = 4000
+PROMPT_TEXT_MAX_CHARS = 6000
+
+
+def _compress_ocr_text(text: str) -> str:
+    """Fewer prompt tokens, same content: drop noise tokens, collapse whitespace."""
+    text = _RE_PUNCT_RUN.sub(r"\1\1", text or "")
+    return _norm_spaces(_RE_NOISE_TOKEN.sub(" ", text))
+
+
+def _slice_ocr_text(text: str, doc_type: str) -> str:
+    """
+    4000 chars are enough when the identifiers Groq must extract are already in
+    them; otherwise (identifier further down, e.g. page 2) keep up to 6000.
+    """
+    head = text[:PROMPT_TEXT_CHARS]
+    needed = _PROMPT_KEY_IDS_NEEDED.get(doc_type, 1)
+    found = 0
+    for _m in _RE_PROMPT_KEY_ID.finditer(head):
+        found += 1
+        if found >= needed:
+            return head
+    return text[:PROMPT_TEXT_MAX_CHARS]
+
+
+# Variable part of the prompt, one block per document: template parsed once here,
+# only the values are substituted per call
+_GROQ_DOCUMENT_TEMPLATE = """
+TYPE DE DOCUMENT ATTENDU : {doc_type}
+
+TEXTE OCR:
+{text}
+
+STRUCTURE:
+{structure_json}
+
+TECH REPORT:
+{tech_json}
 """.strip()
 
+
+def _groq_document_block(text: str, structure: dict, tech_report: dict, doc_type: str) -> str:
+    # file_path is left out: local temp path, useless to the model (and it
+    # would make identical documents produce different prompts / cache keys)
+    tech_report = {k: v for k, v in (tech_report or {}).items() if k != "file_path"}
+    return _GROQ_DOCUMENT_TEMPLATE.format_map({
+        "doc_type": doc_type,
+        "text": _slice_ocr_text(_compress_ocr_text(text), doc_type),
+        "structure_json": orjson.dumps(structure).decode(),
+        "tech_json": orjson.dumps(tech_report).decode(),
+    })
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _groq_json_cached(key: str, _validator, _prompt: str, _system: str, _model: str) -> dict:
+    """
+    In-process layer (Streamlit reruns, same session) over the disk cache.
+    Only `key` is hashed by Streamlit (it already covers model + system + prompt);
+    each hit returns a copy, so callers can mutate the result.
+    """
+    cached = _cache_get(LLM_CACHE_DIR, key)
+    if cached is not None:
+        return cached
+
+    result = _validator._groq_completion(_prompt, _system, _model)
+    _cache_set(LLM_CACHE_DIR, key, result)
+    return result
+
+
+# extracted_data fields cleaned per doc type (UNKNOWN => all of them)
+_NAME_KEYS_BY_TYPE = {
+    "ID": ("cni_full_name",),
+    "BANK": ("bank_account_holder",),
+    "DEATH": ("deceased_full_name",),
+    "LIFE_CONTRACT": ("insured_full_name", "beneficiary_full_name"),
+}
+_CNE_KEYS_BY_TYPE = {
+    "ID": ("cni_cne",),
+    "BANK": (),
+    "DEATH": ("deceased_cne",),
+    "LIFE_CONTRACT": ("insured_cne", "beneficiary_cne"),
+}
+_NAME_KEYS_ALL = tuple(k for keys in _NAME_KEYS_BY_TYPE.values() for k in keys)
+_CNE_KEYS_ALL = tuple(k for keys in _CNE_KEYS_BY_TYPE.values() for k in keys)
+
+# Words expected just before a CNE field in the OCR text (fallback when Groq
+# returned nothing). Tuples: hashable => one compiled scanner per field, cached.
+_CNE_CONTEXT_KEYWORDS = {
+    "cni_cne": ("CNIE", "CIN", "NUM", "N°"),
+    "deceased_cne": ("DECE", "DECED", "CIN", "CNIE", "ID"),
+    "insured_cne": ("ASSURE", "ADHERENT", "SOUSCRIPTEUR", "CIN", "CNIE"),
+    "beneficiary_cne": ("BENEFICIAIRE", "AYANT", "DROIT", "CIN", "CNIE"),
+}
+
+
+# ----------------------------
+# Main class
+# ----------------------------
+class InsuranceValidator:
+    """
+    POLICY:
+    - NEVER auto-reject
+    - ONLY: ACCEPT or REVIEW
+    """
+
+    def __init__(self):
+        # Use cached reader (French + English only)
+        self.reader = get_ocr_reader()
+        # OCR strategy fixed once here (env doesn't change at runtime): no branch per document
+        # (with a shared OCR server the pool would only load extra local models;
+        # pool workers are EasyOCR only, tesserocr stays in-process)
+        use_pool = OCR_WORKERS > 1 and OCR_BACKEND == "easyocr" and not OCR_SERVER_ADDRESS
+        self._ocr_missing = self._ocr_in_pool if use_pool else self._ocr_in_process
+
+        api_key = os.getenv("GROQ_API_KEY")
+        if not api_key:
+            raise ValueError("GROQ_API_KEY non trouvée ! Vérifiez votre fichier .env.")
+        # retries handled by _groq_completion (short per-attempt timeouts), not by the SDK
+        self.client = Groq(api_key=api_key, max_retries=0)
+
+    def analyze_technical_integrity(self, doc, file_path: str, fonts: set | None = None) -> dict:
+        """
+        fonts = font names already collected by the caller's page loop
+        (extract_all_bytes); when None, the pages are walked here.
+        """
+        metadata = doc.metadata or {}
+        creator = (metadata.get("creator") or "").lower()
+        producer = (metadata.get("producer") or "").lower()
+        is_suspicious_tool = bool(_RE_FRAUD_TOOLS.search(creator) or _RE_FRAUD_TOOLS.search(producer))
+
+        if fonts is None:
+            fonts = {f[3] for page in doc for f in page.get_fonts()}
+        font_count = len(fonts)
+
+        potential_tampering = bool(is_suspicious_tool or font_count > 8)
+
+        return {
+            "suspicious_metadata": bool(is_suspicious_tool),
+            "editor_detected": creator if creator else producer,
+            "font_count": font_count,
+            "potential_tampering": potential_tampering,
+            "file_path": file_path,
+        }
+
+    def _ocr_cached(self, img_bytes: bytes, reader_id: str, decode=None) -> list[str]:
+        """
+        readtext(detail=0) behind a content-addressed cache:
+        key = BLAKE2b(image bytes + reader/config id).
+        decode = optional bytes -> ndarray, only run on a cache miss.
+        """
+        key = _content_key(img_bytes, reader_id)
+        cached = _cache_get(OCR_CACHE_DIR, key)
+        if cached is not None:
+            return cached
+
+        result = self.reader.readtext(decode(img_bytes) if decode else img_bytes, **_READTEXT_KW)
+        _cache_set(OCR_CACHE_DIR, key, result)
+        return result
+
+    def _ocr_pages_batched(self, page_images: list[np.ndarray]) -> list[list[str]]:
+        """
+        page_images = raw pixel arrays (H, W, C) straight from PyMuPDF.
+        Pages not found in the OCR cache go through ONE readtext_batched call
+        (detector + recognizer batched), instead of one readtext per page.
+        """
+        reader_id = f"{OCR_READER_ID}|dpi={PDF_OCR_DPI}|gray"
+        keys = [_content_key(img, f"{reader_id}|{img.shape}") for img in page_images]
+        results = [_cache_get(OCR_CACHE_DIR, k) for k in keys]
+
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            batched = self._ocr_missing([page_images[i] for i in missing])
+            for i, tokens in zip(missing, batched):
+                results[i] = tokens
+                _cache_set(OCR_CACHE_DIR, keys[i], tokens)
+
+        return results
+
+    def _ocr_in_process(self, images: list[np.ndarray]) -> list[list[str]]:
+        if len(images) == 1:
+            # single page (most CNI scans): plain readtext, no stack copy / batch setup
+            return [self.reader.readtext(images[0], **_READTEXT_KW)]
+
+        # readtext_batched needs same-size inputs: pad every page (white,
+        # top-left anchored) into ONE preallocated stack instead of
+        # letting EasyOCR resize each page (aspect ratio kept, no resample)
+        stack = _pad_stack(images)
+        return self.reader.readtext_batched(
+            list(stack),  # (H, W) views, no copy
+            batch_size=OCR_BATCH_SIZE,
+            **_READTEXT_KW,
+        )
+
+    def _ocr_in_pool(self, images: list[np.ndarray]) -> list[list[str]]:
+        if len(images) == 1:
+            return self._ocr_in_process(images)
+        # One block for the whole batch: each page is copied once, workers read a view in place
+        shm = shared_memory.SharedMemory(create=True, size=sum(img.nbytes for img in images))
         try:
-            chat = self.client.chat.completions.create(
-                # Change "llama-3.3-70b-versatile" to "llama3-8b-8192"
-                model="llama-3.1-8b-instant",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-                timeout=self.groq_timeout,
-                response_format={"type": "json_object"},
-            )
-            result = json.loads(chat.choices[0].message.content)
+            jobs, offset = [], 0
+            for img in images:
+                np.ndarray(img.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)[...] = img
+                jobs.append((shm.name, offset, img.shape))
+                offset += img.nbytes
+            return get_ocr_pool().map(_ocr_page, jobs)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def extract_all(self, file_path: str, file_bytes: bytes | None = None, fileName=None):
+        """
+        Path-based entry point, kept for callers that only have a file on disk.
+        """
+        if file_bytes is None:
+            with open(file_path, "rb") as f:
+                file_bytes = f.read()
+        return self.extract_all_bytes(file_bytes, os.path.splitext(file_path)[1], file_path=file_path)
+
+    def extract_all_bytes(self, file_bytes: bytes, ext: str, file_path: str = ""):
+        """
+        OCR straight from memory (no temp file, no re-read from disk):
+        - PDF via fitz.open(stream=...) pages -> pixmap -> numpy array (no PNG roundtrip)
+        - IMAGE via bytes (jpg/png/webp) passed from app.py
+        CACHE:
+        - whole document (file hash) -> (text, structure, tech_report)
+        - each page image (pixel hash) -> OCR tokens
+        """
+        ext = "." + (ext or "").lower().lstrip(".")
+        file_path = file_path or f"document{ext}"
+        # Add this line at the start
+        # This creates a visual progress box in the Streamlit UI
+        file_name = os.path.basename(file_path)
+        with st.status(f"Analyse de {file_name}...", expanded=False) as status:
+            st.write("🔍 [Etape 1/2] Extraction du texte (OCR)...")
+            print(f"🔍 OCR: {file_name}")
+
+        # Document-level short-circuit: same file + same OCR config => no OCR at all
+        doc_key = _content_key(file_bytes, f"{OCR_READER_ID}|doc|dpi={PDF_OCR_DPI}|gray|max={OCR_MAX_SIDE}|native={NATIVE_TEXT_MIN_CHARS}")
+        cached = _cache_get(OCR_CACHE_DIR, doc_key)
+        if cached is not None:
+            tech_report = cached["tech_report"]
+            tech_report["file_path"] = file_path
+            status.update(label=f"OCR (cache) pour {file_name}", state="complete")
+            return cached["text"], cached["structure"], tech_report
+
+        # IMAGE mode
+        if ext in [".png", ".jpg", ".jpeg", ".webp"]:
+            structure = {"has_images": True, "page_count": 1, "has_tables": False, "has_native_text": False}
+            tech_report = {
+                "suspicious_metadata": False,
+                "editor_detected": "image_upload",
+                "font_count": 0,
+                "potential_tampering": False,
+                "file_path": file_path,
+            }
+
+            # ONE OCR pass (it used to run twice on the same bytes); decoded once
+            # here, gray like the PDF pages, so EasyOCR doesn't re-decode.
+            text_results = self._ocr_cached(file_bytes, f"{OCR_READER_ID}|gray|max={OCR_MAX_SIDE}", decode=_decode_gray)
+
+            raw_text = " ".join(text_results)
+            if DEBUG_OCR:
+                print(f"\n--- DEBUG: RAW OCR FOR {file_path} ---")
+                print(raw_text)
+                print("-" * 40 + "\n")
+            _cache_set(OCR_CACHE_DIR, doc_key, {"text": raw_text, "structure": structure, "tech_report": tech_report})
+            return raw_text, structure, tech_report
+
+        # PDF mode: one thread renders pages (fitz) while this one OCRs the
+        # pages already rendered => wall time ~ max(render, OCR) instead of the sum
+        text_results = []
+        scanned = queue.Queue()  # one image per scanned page, None = done
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-render") as pool:
+            render = pool.submit(self._render_pdf, file_bytes, ext, file_path, scanned)
+
+            ocr_results = []
+            done = False
+            while not done:
+                # block for one page, then take whatever else is ready (up to a batch)
+                batch = []
+                item = scanned.get()
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= OCR_BATCH_SIZE:
+                        break
+                    try:
+                        item = scanned.get_nowait()
+                    except queue.Empty:
+                        break
+                done = item is None
+                if batch:
+                    ocr_results.extend(self._ocr_pages_batched(batch))
+
+            structure, tech_report, page_tokens = render.result()
+
+        # Scanned pages re-inserted in page order
+        ocr_results = iter(ocr_results)
+        for tokens in page_tokens:
+            text_results.extend(tokens if tokens is not None else next(ocr_results))
+        raw_text = " ".join(text_results)
+        if DEBUG_OCR:
+            print(f"DEBUG FULL OCR: {raw_text}")
+        st.write("📝 Texte extrait avec succès.")
+        status.update(label=f"OCR terminé pour {file_name}", state="complete")
+        _cache_set(OCR_CACHE_DIR, doc_key, {"text": raw_text, "structure": structure, "tech_report": tech_report})
+        return raw_text, structure, tech_report
+
+    def _render_pdf(self, file_bytes: bytes, ext: str, file_path: str, scanned: queue.Queue):
+        """
+        Producer (render thread): structure + technical checks, native text of
+        digital pages, and scanned pages pushed to `scanned` as soon as rendered.
+        Returns (structure, tech_report, page_tokens); always ends with None in the queue.
+        """
+        structure = {"has_images": False, "page_count": 0, "has_tables": False, "has_native_text": False}
+        try:
+            with _FITZ_LOCK, fitz.open(stream=file_bytes, filetype=ext.lstrip(".") or "pdf") as doc:
+                structure["page_count"] = len(doc)
+
+                fonts = set()  # filled in the page loop: each page is visited once
+                page_tokens = []  # per page: tokens, or None = waiting for OCR
+                for page in doc:
+                    fonts.update(f[3] for f in page.get_fonts())
+                    # document-level booleans: once True, later pages skip the (costly) listing
+                    if not structure["has_images"] and page.get_images(full=False):
+                        structure["has_images"] = True
+                    if not structure["has_tables"] and len(page.get_drawings()) > 10:
+                        structure["has_tables"] = True
+
+                    # Digital PDF (FPDF, bank export...): the text layer is enough, skip OCR
+                    native = page.get_text("text")
+                    if len(native.strip()) > NATIVE_TEXT_MIN_CHARS:
+                        structure["has_native_text"] = True
+                        page_tokens.append([_norm_spaces(native)])
+                        continue
+
+                    # OCR only needs luminance: 1 byte/pixel instead of 3 (RGB)
+                    pix = page.get_pixmap(dpi=PDF_OCR_DPI, colorspace=fitz.csGRAY, alpha=False)
+                    page_tokens.append(None)
+                    scanned.put(resize_for_ocr(_pixmap_to_array(pix), OCR_MAX_SIDE))
+
+                tech_report = self.analyze_technical_integrity(doc, file_path, fonts=fonts)
+        finally:
+            scanned.put(None)
+
+        return structure, tech_report, page_tokens
+
+    def _groq_json(self, prompt: str, system: str = _GROQ_INSTRUCTIONS,
+                   model: str = GROQ_MODEL, temperature: float = 0) -> dict:
+        """
+        Groq chat completion (JSON mode). Deterministic calls (temperature 0)
+        go through the in-process then disk cache, keyed by
+        BLAKE2b(model + system + prompt).
+        The static rules go in the system message: a stable prefix across calls,
+        so Groq's prompt caching can reuse it; only the document block changes.
+        """
+        if temperature != 0:
+            return self._groq_completion(prompt, system, model, temperature)
+
+        key = _content_key(f"{system}\x00{prompt}".encode("utf-8"), f"groq:{model}")
+        return _groq_json_cached(key, self, prompt, system, model)
+
+    def _groq_completion(self, prompt: str, system: str, model: str, temperature: float = 0) -> dict:
+        # Transient errors (network, timeout, 408/409/429/5xx) are retried with backoff;
+        # anything else (auth, bad request) is raised at once
+        for attempt, (timeout, pause) in enumerate(GROQ_ATTEMPTS):
+            time.sleep(pause)
+            try:
+                chat = self.client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system},
+                        {"role": "user", "content": prompt},
+                    ],
+                    temperature=temperature,
+                    timeout=timeout,
+                    response_format={"type": "json_object"},
+                )
+                break
+            except (groq.APIConnectionError, groq.APIStatusError) as e:  # APITimeoutError is an APIConnectionError
+                if not _groq_transient(e) or attempt == len(GROQ_ATTEMPTS) - 1:
+                    raise
+        return orjson.loads(chat.choices[0].message.content)
+
+    def validate_with_groq(self, text: str, structure: dict, tech_report: dict, forced_doc_type: str):
+        # Show a small notification at the bottom of the screen
+        st.toast(f"🧠 Intelligence Artificielle : Analyse du document {forced_doc_type}...")
+
+        forced_doc_type = (forced_doc_type or "").strip().upper()
+        if forced_doc_type not in {"ID", "BANK", "DEATH", "LIFE_CONTRACT"}:
+            forced_doc_type = "UNKNOWN"
+
+        rejected = self._prefilter(forced_doc_type, text)
+        if rejected is not None:
+            return rejected
+
+        prompt = _groq_document_block(text, structure, tech_report, forced_doc_type)
+
+        try:
+            result = self._groq_json(prompt, model=_MODEL_BY_DOC.get(forced_doc_type, GROQ_MODEL))
             result["doc_type"] = forced_doc_type
             st.success(f"✅ Analyse {forced_doc_type} terminée.")
 
@@ -437,18 +1160,90 @@ TYPE: LIFE_CONTRACT
         except groq.AuthenticationError:
             raise ValueError("Clé API GROQ invalide.")
         except Exception as e:
-            return {
-                "decision": "REVIEW",
-                "is_valid": False,
-                "score": 0,
-                "country": "MAROC",
-                "doc_type": forced_doc_type,
-                "fraud_suspected": False,
-                "fraud_signals": [],
-                "extracted_data": {},
-                "format_validation": {},
-                "reason": f"Erreur API/système : {str(e)}",
-            }
+            return self._error_result(forced_doc_type, e)
+
+    def validate_batch(self, docs: dict[str, tuple[str, dict, dict]]) -> dict[str, dict]:
+        """
+        docs = {doc_type: (text, structure, tech_report)}
+        ONE Groq call for the whole case (instead of one per document): the
+        static rules/examples are sent once, each document is a labeled block.
+        Every verdict still goes through _validate_extracted_data.
+        """
+        st.toast(f"🧠 Intelligence Artificielle : Analyse groupée ({len(docs)} documents)...")
+
+        docs = {(t or "").strip().upper(): v for t, v in docs.items()}
+
+        # Same local pre-filter as validate_with_groq: rejected docs leave the batch
+        results = {}
+        for doc_type, (text, _structure, _tech_report) in list(docs.items()):
+            rejected = self._prefilter(doc_type, text)
+            if rejected is not None:
+                results[doc_type] = rejected
+                del docs[doc_type]
+        if not docs:
+            return results
+
+        blocks = [
+            f"=== DOCUMENT {doc_type} ===\n" + _groq_document_block(text, structure, tech_report, doc_type)
+            for doc_type, (text, structure, tech_report) in docs.items()
+        ]
+        prompt = _GROQ_BATCH_FORMAT.format(types=", ".join(docs)) + "\n\n" + "\n\n".join(blocks)
+
+        try:
+            # one call => one model: an override asked by any document of the batch wins
+            overrides = (_MODEL_BY_DOC.get(t, GROQ_MODEL) for t in docs)
+            model = next((m for m in overrides if m != GROQ_MODEL), GROQ_MODEL)
+            batch = self._groq_json(prompt, model=model)
+        except groq.AuthenticationError:
+            raise ValueError("Clé API GROQ invalide.")
+        except Exception as e:
+            results.update({doc_type: self._error_result(doc_type, e) for doc_type in docs})
+            return results
+
+        for doc_type, (text, _structure, tech_report) in docs.items():
+            result = batch.get(doc_type)
+            if not isinstance(result, dict):
+                results[doc_type] = self._error_result(doc_type, "document absent de la réponse groupée")
+                continue
+            result["doc_type"] = doc_type
+            try:
+                results[doc_type] = self._validate_extracted_data(result, tech_report, text)
+            except Exception as e:
+                # one malformed verdict must not take the other documents down
+                results[doc_type] = self._error_result(doc_type, e)
+
+        st.success(f"✅ Analyse groupée terminée ({', '.join(docs)}).")
+        return results
+
+    @classmethod
+    def _prefilter(cls, doc_type: str, text: str) -> dict | None:
+        """
+        Gibberish / off-topic text: skip the LLM (a human has to look at it anyway).
+        Returns a REVIEW result, or None when the text may go to Groq.
+        """
+        kw = _DOC_TYPE_KEYWORDS.get(doc_type)
+        if kw is None or kw.search(text or ""):
+            return None
+        return cls._review_result(doc_type, f"Aucun mot-clé attendu pour un document {doc_type} (pré-filtre local).")
+
+    @classmethod
+    def _error_result(cls, doc_type: str, error) -> dict:
+        return cls._review_result(doc_type, f"Erreur API/système : {str(error)}")
+
+    @staticmethod
+    def _review_result(doc_type: str, reason: str) -> dict:
+        return {
+            "decision": "REVIEW",
+            "is_valid": False,
+            "score": 0,
+            "country": "MAROC",
+            "doc_type": doc_type,
+            "fraud_suspected": False,
+            "fraud_signals": [],
+            "extracted_data": {},
+            "format_validation": {},
+            "reason": reason,
+        }
 
 
 
@@ -466,14 +1261,13 @@ TYPE: LIFE_CONTRACT
         extracted = groq_result.get("extracted_data", {}) or {}
         dt = (groq_result.get("doc_type") or "UNKNOWN").strip().upper()
 
-        # Clean names
-        for k in ["cni_full_name", "bank_account_holder", "deceased_full_name",
-                  "insured_full_name", "beneficiary_full_name"]:
+        # Clean names (only the fields of this doc type)
+        for k in _NAME_KEYS_BY_TYPE.get(dt, _NAME_KEYS_ALL):
             if k in extracted:
                 extracted[k] = _clean_name(extracted.get(k, ""))
 
         # Normalize CNE fields
-        for k in ["cni_cne", "deceased_cne", "insured_cne", "beneficiary_cne"]:
+        for k in _CNE_KEYS_BY_TYPE.get(dt, _CNE_KEYS_ALL):
             if extracted.get(k):
                 extracted[k] = _normalize_cne(extracted[k])
 
@@ -491,8 +1285,8 @@ TYPE: LIFE_CONTRACT
                 return None
 
             # --- FIX: Pre-clean dots into slashes for unified format ---
-            v_clean = re.sub(r"[.\-]", "/", v)
-            v_clean = re.sub(r"\s+", "/", v_clean)
+            v_clean = _RE_DATE_SEP.sub("/", v)
+            v_clean = _RE_SPACES.sub("/", v_clean)
             # -----------------------------------------------------------
 
             ok, formatted_or_msg = validate_date_format(v_clean)
@@ -511,10 +1305,15 @@ TYPE: LIFE_CONTRACT
                 return None
             return d
 
-        def _check_cne_field(key: str, label: str, fallback_keywords: list[str]):
+        raw_upper = None  # uppercased OCR text, built on the first CNE fallback only
+
+        def _check_cne_field(key: str, label: str):
+            nonlocal raw_upper
             v = extracted.get(key, "")
             if not v:
-                fb = _extract_cne_by_context(raw_ocr_text, fallback_keywords)
+                if raw_upper is None:
+                    raw_upper = (raw_ocr_text or "").upper()
+                fb = _extract_cne_by_context(raw_upper, _CNE_CONTEXT_KEYWORDS[key])
                 if fb:
                     extracted[key] = fb
                     v = fb
@@ -528,7 +1327,7 @@ TYPE: LIFE_CONTRACT
 
         # ID rules
         if dt == "ID":
-            _check_cne_field("cni_cne", "CNE (CNI)", ["CNIE", "CIN", "NUM", "N°"])
+            _check_cne_field("cni_cne", "CNE (CNI)")
             _check_date_field("cni_birth_date", "Date naissance (CNI)")
             exp = _check_date_field("cni_expiry_date", "Date expiration (CNI)")
             # your rule: expiry must be > today
@@ -550,7 +1349,7 @@ TYPE: LIFE_CONTRACT
 
             # --- 0) Lire IBAN OCR (si présent), le nettoyer, et vérifier checksum ---
             iban_ocr_raw = _norm_spaces(ex.get("bank_iban", "")).upper()
-            iban_ocr_clean = re.sub(r"[^A-Z0-9]", "", iban_ocr_raw)
+            iban_ocr_clean = iban_ocr_raw.translate(_KEEP_UPPER_ALNUM)
 
             # si "MA" apparaît au milieu, on découpe à partir de MA sur 28 chars
             if "MA" in iban_ocr_clean:
@@ -590,10 +1389,10 @@ TYPE: LIFE_CONTRACT
 
             else:
                 # --- 2) FALLBACK: champs OCR -> normalisation -> reconstruction IBAN ---
-                cb = re.sub(r"\D", "", ex.get("bank_code_banque", "") or "").zfill(3)
-                cv = re.sub(r"\D", "", ex.get("bank_code_ville", "") or "").zfill(3)
-                nc = re.sub(r"\D", "", ex.get("bank_numero_compte", "") or "")
-                kr = re.sub(r"\D", "", ex.get("bank_cle_rib", "") or "").zfill(2)
+                cb = (ex.get("bank_code_banque", "") or "").translate(_KEEP_DIGITS).zfill(3)
+                cv = (ex.get("bank_code_ville", "") or "").translate(_KEEP_DIGITS).zfill(3)
+                nc = (ex.get("bank_numero_compte", "") or "").translate(_KEEP_DIGITS)
+                kr = (ex.get("bank_cle_rib", "") or "").translate(_KEEP_DIGITS).zfill(2)
 
                 # compte = 16 chiffres (OCR peut coller banque+ville+compte)
                 if len(nc) > 16:
@@ -632,7 +1431,7 @@ TYPE: LIFE_CONTRACT
 
         # DEATH rules
         elif dt == "DEATH":
-            _check_cne_field("deceased_cne", "CNE (décès)", ["DECE", "DECED", "CIN", "CNIE", "ID"])
+            _check_cne_field("deceased_cne", "CNE (décès)")
             _check_date_field("deceased_birth_date", "Date naissance (décès)")
             dth = _check_date_field("death_date", "Date décès")
             # your rule: death date must be < today
@@ -642,8 +1441,8 @@ TYPE: LIFE_CONTRACT
 
         # LIFE_CONTRACT rules
         elif dt == "LIFE_CONTRACT":
-            _check_cne_field("insured_cne", "CNE (assuré)", ["ASSURE", "ADHERENT", "SOUSCRIPTEUR", "CIN", "CNIE"])
-            _check_cne_field("beneficiary_cne", "CNE (bénéficiaire)", ["BENEFICIAIRE", "AYANT", "DROIT", "CIN", "CNIE"])
+            _check_cne_field("insured_cne", "CNE (assuré)")
+            _check_cne_field("beneficiary_cne", "CNE (bénéficiaire)")
 
             _check_date_field("insured_birth_date", "Naissance (assuré)")
             _check_date_field("beneficiary_birth_date", "Naissance (bénéficiaire)")
@@ -691,7 +1490,8 @@ TYPE: LIFE_CONTRACT
         groq_result["score"] = final_score
 
         groq_result["fraud_suspected"] = len(fraud_signals) > 0
-        groq_result["fraud_signals"] = list(set(groq_result.get("fraud_signals", []) + fraud_signals))
+        # order-preserving dedup (Groq's signals first): stable display / audit
+        groq_result["fraud_signals"] = list(dict.fromkeys((*(groq_result.get("fraud_signals") or ()), *fraud_signals)))
 
         if tech_report.get("potential_tampering"):
             groq_result["decision"] = "REVIEW"